@@ -1,3 +1,5 @@
+import sys
+
 from trino.auth import RedirectHandler, CompositeRedirectHandler, WebBrowserRedirectHandler
 
 class DockerConsoleRedirectHandler(RedirectHandler):
@@ -11,9 +13,15 @@ class DockerConsoleRedirectHandler(RedirectHandler):
       | Use a proper certificate in production instead!!
     """
 
+    def __init__(self, needle: str = "https://trino-proxy", replacement: str = "http://localhost:38191") -> None:
+        self._needle = needle
+        self._replacement = replacement
+
     def __call__(self, url: str) -> None:
-        print("Open the following URL in browser for the external authentication:")
-        print(url.replace("https://trino-proxy", "http://localhost:38191"))
+        sys.stdout.write(
+            "Open the following URL in browser for the external authentication:\n"
+            f"{url.replace(self._needle, self._replacement)}\n"
+        )
 
 
 REDIRECT_HANDLER = CompositeRedirectHandler([
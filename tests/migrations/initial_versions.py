@@ -1,5 +1,9 @@
+import argparse
+import functools
+import json
 import tomllib
 
+@functools.cache
 def get_crate_version_parts():
     with open("../../Cargo.toml", "rb") as f:
         cargo_data = tomllib.load(f)
@@ -18,14 +22,37 @@ def previous_minor_version_of(major, minor):
         # Assume the latest release of the previous major version is tagged on quay as follows.
         return f"{major - 1}"
 
-if __name__ == "__main__":
+@functools.cache
+def get_versions_to_test():
     crate_version_parts  = get_crate_version_parts()
     prev_minor = previous_minor_version_of(crate_version_parts[0], crate_version_parts[1])
     # Referencing tags for quay.io/lakekeeper/catalog
-    versions = [
+    return (
         "latest", # the latest version released to quay.io
         f"v{prev_minor}"
-    ]
-    # Print in the format expected by the migrations workflow.
-    print(f"initial-versions={versions}")
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    output_format = parser.add_mutually_exclusive_group()
+    output_format.add_argument(
+        "--github-output",
+        action = "store_const",
+        const = "github-output",
+        dest = "output_format",
+        help = "Print in the format expected by the migrations workflow (default)",
+    )
+    output_format.add_argument(
+        "--json",
+        action = "store_const",
+        const = "json",
+        dest = "output_format",
+        help = "Print the versions as json list",
+    )
+    args = parser.parse_args()
 
+    versions = json.dumps(list(get_versions_to_test()))
+    if args.output_format == "json":
+        print(versions)
+    else:
+        print(f"initial-versions={versions}")
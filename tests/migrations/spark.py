@@ -1,54 +1,96 @@
 import argparse
+import functools
 import json
+import os
 import sys
 import time
-
-import pyspark
-from pyspark.conf import SparkConf
-from pyspark.sql import SparkSession
-from pyspark.sql.types import FloatType, LongType, StructType, StructField, StringType
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 # Leave at least one table undropped.
 TABLES_TO_MAINTAIN = ["my_table_0", "my_table_1"]
 TABLES_TO_DROP = ["my_table_2"]
 TABLE_POST_MIGRATION = "my_table_3"
+WAREHOUSE = "demo"
+
+# DDL string instead of a `StructType`, so pyspark is only imported once a session is created.
+TABLE_SCHEMA = "id BIGINT, strings STRING, floats FLOAT"
+# Rows of all tables created before the migration.
+PRE_MIGRATION_ROWS = [
+    [1, 'a-string', 1.1],
+    [2, 'b-string', 2.2]
+]
+# Rows appended to `TABLES_TO_MAINTAIN` after the migration.
+POST_MIGRATION_ROWS = [[3, 'c-string', 3.3]]
+# Rows of `TABLE_POST_MIGRATION`.
+NEW_TABLE_ROWS = [[4, 'd-string', 4.4]]
+
+# Print table contents in addition to checking row counts, e.g. for local debugging.
+VERBOSE = os.environ.get("MIGRATION_VERBOSE") == "1"
 
-TABLE_SCHEMA = StructType([
-        StructField("id", LongType(), True),
-        StructField("strings", StringType(), True),
-        StructField("floats", FloatType(), True),
-])
+ICEBERG_VERSION = "1.6.1"
+SPARK_PARALLELISM = min(os.cpu_count() or 1, 4)
+
+SPARK_CONFIG = {
+    "spark.sql.catalog.lakekeeper": "org.apache.iceberg.spark.SparkCatalog",
+    "spark.sql.catalog.lakekeeper.type": "rest",
+    "spark.sql.catalog.lakekeeper.warehouse": WAREHOUSE,
+    "spark.sql.catalog.lakekeeper.io-impl": "org.apache.iceberg.aws.s3.S3FileIO",
+    "spark.sql.extensions": "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions",
+    "spark.sql.defaultCatalog": "lakekeeper",
+    # The test data is tiny, avoid fanning out into many empty tasks.
+    "spark.sql.shuffle.partitions": str(SPARK_PARALLELISM),
+    "spark.default.parallelism": str(SPARK_PARALLELISM),
+}
+# Reuse resolved jars across runs instead of downloading them from Maven Central every time.
+if os.environ.get("IVY_CACHE_DIR"):
+    SPARK_CONFIG["spark.jars.ivy"] = os.environ["IVY_CACHE_DIR"]
 
 def spark_session(catalog_url):
     """
     Creates and returns a spark session.
     """
-    WAREHOUSE = "demo"
-
-    SPARK_VERSION = pyspark.__version__
-    SPARK_MINOR_VERSION = '.'.join(SPARK_VERSION.split('.')[:2])
-    ICEBERG_VERSION = "1.6.1"
+    # Imported lazily, so e.g. `--help` and argument errors don't pay for loading pyspark.
+    import pyspark
+    from pyspark.conf import SparkConf
+    from pyspark.sql import SparkSession
 
+    spark_minor_version = '.'.join(pyspark.__version__.split('.')[:2])
     config = {
-        f"spark.sql.catalog.lakekeeper": "org.apache.iceberg.spark.SparkCatalog",
-        f"spark.sql.catalog.lakekeeper.type": "rest",
-        f"spark.sql.catalog.lakekeeper.uri": catalog_url,
-        f"spark.sql.catalog.lakekeeper.warehouse": WAREHOUSE,
-        f"spark.sql.catalog.lakekeeper.io-impl": "org.apache.iceberg.aws.s3.S3FileIO",
-        "spark.sql.extensions": "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions",
-        "spark.sql.defaultCatalog": "lakekeeper",
-        "spark.jars.packages": f"org.apache.iceberg:iceberg-spark-runtime-{SPARK_MINOR_VERSION}_2.12:{ICEBERG_VERSION},org.apache.iceberg:iceberg-aws-bundle:{ICEBERG_VERSION}",
+        **SPARK_CONFIG,
+        "spark.sql.catalog.lakekeeper.uri": catalog_url,
+        "spark.jars.packages": f"org.apache.iceberg:iceberg-spark-runtime-{spark_minor_version}_2.12:{ICEBERG_VERSION},org.apache.iceberg:iceberg-aws-bundle:{ICEBERG_VERSION}",
     }
-    spark_config = SparkConf().setMaster('local').setAppName("Iceberg-REST")
-    for k, v in config.items():
-        spark_config = spark_config.set(k, v)
+    spark_config = (
+        SparkConf()
+        .setMaster(f'local[{SPARK_PARALLELISM}]')
+        .setAppName("Iceberg-REST")
+        .setAll(config.items())
+    )
     spark = SparkSession.builder.config(conf=spark_config).getOrCreate()
+    init_catalog(spark)
+
+    return spark
 
+def init_catalog(spark):
+    """
+    Selects the catalog and creates the test namespace once per spark session.
+    """
+    if hasattr(spark, "_lakekeeper_initialized"):
+        return
     spark.sql("USE lakekeeper")
     spark.sql("CREATE NAMESPACE IF NOT EXISTS my_namespace")
-    spark.sql("SHOW NAMESPACES").show()
+    spark._lakekeeper_initialized = True
 
-    return spark
+def check_table(spark, table, expected_rows):
+    """
+    Checks that a table can be read and contains the expected number of rows.
+    """
+    df = spark.sql(f"SELECT * FROM my_namespace.{table}")
+    if VERBOSE:
+        df.show()
+    row_count = df.count()
+    assert row_count == expected_rows, f"Expected {expected_rows} rows in {table}, found {row_count}"
 
 def read(spark):
     """
@@ -56,7 +98,7 @@ def read(spark):
     """
     print("Reading data")
     for table in TABLES_TO_MAINTAIN:
-        spark.sql(f"SELECT * FROM my_namespace.{table}").show()
+        check_table(spark, table, len(PRE_MIGRATION_ROWS))
 
 def get_short_soft_delete_expiration():
     with open("./create-warehouse/soft-delete-1sec.json") as f:
@@ -70,69 +112,221 @@ def write_pre_migration(spark):
     # Lakekeeper migration issues can be related to (soft) deleted tables.
     # So create and drop some tables to simulate that situation.
     print("Creating tables")
-    for table in TABLES_TO_MAINTAIN + TABLES_TO_DROP:
-        df = spark.createDataFrame([], TABLE_SCHEMA)
-        df.writeTo(f"my_namespace.{table}").createOrReplace()
+    # All tables share the same schema and rows, so the dataframe can be reused.
+    df = spark.createDataFrame(PRE_MIGRATION_ROWS, TABLE_SCHEMA)
 
-        # Insert some rows.
-        schema = spark.table(f"my_namespace.{table}").schema
-        data = [
-            [1, 'a-string', 1.1],
-            [2, 'b-string', 2.2]
-        ]
-        df = spark.createDataFrame(data, schema)
-        df.writeTo(f"my_namespace.{table}").append()
+    def seed_one(table):
+        # Create the table together with some rows in a single commit.
+        df.writeTo(f"my_namespace.{table}").createOrReplace()
 
-        spark.sql(f"SELECT * FROM my_namespace.{table}").show()
+    # Tables are independent of each other, so seed them concurrently.
+    tables = TABLES_TO_MAINTAIN + TABLES_TO_DROP
+    with ThreadPoolExecutor(max_workers=min(8, len(tables))) as executor:
+        list(executor.map(seed_one, tables))
+    # Check outside of the pool to not interleave verbose output.
+    for table in tables:
+        check_table(spark, table, len(PRE_MIGRATION_ROWS))
 
     # Use all `DROP` variants to delete some of the tables.
     print("Deleting some of the tables")
     for table in TABLES_TO_DROP:
         spark.sql(f"DROP TABLE my_namespace.{table}")
 
-    # Sleep to let (short) soft-delete timeout expire.
+    # Wait for the (short) soft-delete timeout to expire.
     # Actually only necessary only if the warehouse is configured with short soft delete expiration.
-    # However waiting a few seconds here doesn't hurt.
-    time.sleep(get_short_soft_delete_expiration())
+    wait_for_dropped_tables_to_expire(spark.conf.get("spark.sql.catalog.lakekeeper.uri"))
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+def get_warehouse_id(management_url):
+    """
+    Returns the id of the `WAREHOUSE` warehouse.
+    """
+    response = get_json(f"{management_url}/v1/warehouse")
+    for warehouse in response["warehouses"]:
+        if warehouse["name"] == WAREHOUSE:
+            # `id` is deprecated in favor of `warehouse-id`, but older releases only return `id`.
+            return warehouse.get("warehouse-id") or warehouse["id"]
+    raise ValueError(f"Warehouse {WAREHOUSE} not found")
+
+def list_soft_deleted_tables(management_url, warehouse_id):
+    """
+    Returns the names of soft-deleted tables in `my_namespace`.
+    """
+    response = get_json(f"{management_url}/v1/warehouse/{warehouse_id}/deleted-tabulars")
+    return {
+        tabular["name"]
+        for tabular in response["tabulars"]
+        if tabular["namespace"] == ["my_namespace"]
+    }
+
+def wait_for_dropped_tables_to_expire(catalog_url):
+    """
+    Polls until none of `TABLES_TO_DROP` is soft-deleted anymore.
+
+    Returns immediately for warehouses that hard-delete tables. Gives up after the short soft-delete
+    expiration, as tables of warehouses with a longer expiration remain soft-deleted.
+    """
+    management_url = catalog_url.rstrip("/").removesuffix("/catalog") + "/management"
+    warehouse_id = get_warehouse_id(management_url)
+
+    deadline = time.monotonic() + get_short_soft_delete_expiration()
+    while not list_soft_deleted_tables(management_url, warehouse_id).isdisjoint(TABLES_TO_DROP):
+        if time.monotonic() >= deadline:
+            return
+        time.sleep(0.1)
 
 def write_post_migration(spark):
     """
     Writes to existing tables and creates a new one.
     """
     # existing tables
+    df = spark.createDataFrame(POST_MIGRATION_ROWS, TABLE_SCHEMA)
     for table in TABLES_TO_MAINTAIN:
-        schema = spark.table(f"my_namespace.{table}").schema
-        data = [[3, 'c-string', 3.3]]
-        df = spark.createDataFrame(data, schema)
         df.writeTo(f"my_namespace.{table}").append()
 
-        spark.sql(f"SELECT * FROM my_namespace.{table}").show()
+        check_table(spark, table, len(PRE_MIGRATION_ROWS) + len(POST_MIGRATION_ROWS))
 
     # new table
     df = spark.createDataFrame([], TABLE_SCHEMA)
     df.writeTo(f"my_namespace.{TABLE_POST_MIGRATION}").createOrReplace()
-    schema = spark.table(f"my_namespace.{TABLE_POST_MIGRATION}").schema
-    data = [[4, 'd-string', 4.4]]
-    df = spark.createDataFrame(data, schema)
+    df = spark.createDataFrame(NEW_TABLE_ROWS, TABLE_SCHEMA)
     df.writeTo(f"my_namespace.{TABLE_POST_MIGRATION}").append()
-    spark.sql(f"SELECT * FROM my_namespace.{TABLE_POST_MIGRATION}").show()
+    check_table(spark, TABLE_POST_MIGRATION, len(NEW_TABLE_ROWS))
+
+def pyiceberg_catalog(catalog_url):
+    """
+    Creates and returns a pyiceberg catalog.
+    """
+    # Imported lazily, so the spark engine doesn't require pyiceberg to be installed.
+    from pyiceberg.catalog import load_catalog
+
+    catalog = load_catalog("lakekeeper", type="rest", uri=catalog_url, warehouse=WAREHOUSE)
+    catalog.create_namespace_if_not_exists("my_namespace")
+    return catalog
+
+@functools.cache
+def arrow_schema():
+    """
+    Returns the arrow schema of the test tables, equivalent to `TABLE_SCHEMA`.
+    """
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("strings", pa.string()),
+        ("floats", pa.float32()),
+    ])
+
+def to_arrow(rows):
+    """
+    Converts rows to an arrow table with the schema of the test tables.
+    """
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    return pa.Table.from_pylist([dict(zip(schema.names, row)) for row in rows], schema=schema)
+
+def check_table_pyiceberg(catalog, table, expected_rows):
+    """
+    Checks that a table can be read and contains the expected number of rows.
+    """
+    data = catalog.load_table(("my_namespace", table)).scan().to_arrow()
+    if VERBOSE:
+        print(data)
+    assert data.num_rows == expected_rows, f"Expected {expected_rows} rows in {table}, found {data.num_rows}"
+
+def read_pyiceberg(catalog):
+    """
+    Reads data from tables that are expected to exist.
+    """
+    print("Reading data")
+    for table in TABLES_TO_MAINTAIN:
+        check_table_pyiceberg(catalog, table, len(PRE_MIGRATION_ROWS))
+
+def write_pre_migration_pyiceberg(catalog):
+    """
+    Creates tables and drops some of them for the provided pyiceberg catalog.
+    """
+    # Lakekeeper migration issues can be related to (soft) deleted tables.
+    # So create and drop some tables to simulate that situation.
+    print("Creating tables")
+    data = to_arrow(PRE_MIGRATION_ROWS)
+
+    def seed_one(table):
+        catalog.create_table(("my_namespace", table), schema=arrow_schema()).append(data)
+
+    # Tables are independent of each other, so seed them concurrently.
+    tables = TABLES_TO_MAINTAIN + TABLES_TO_DROP
+    with ThreadPoolExecutor(max_workers=min(8, len(tables))) as executor:
+        list(executor.map(seed_one, tables))
+    for table in tables:
+        check_table_pyiceberg(catalog, table, len(PRE_MIGRATION_ROWS))
+
+    print("Deleting some of the tables")
+    for table in TABLES_TO_DROP:
+        catalog.drop_table(("my_namespace", table))
+
+    # Wait for the (short) soft-delete timeout to expire.
+    # Actually only necessary only if the warehouse is configured with short soft delete expiration.
+    wait_for_dropped_tables_to_expire(catalog.properties["uri"])
+
+def write_post_migration_pyiceberg(catalog):
+    """
+    Writes to existing tables and creates a new one.
+    """
+    # existing tables
+    data = to_arrow(POST_MIGRATION_ROWS)
+    for table in TABLES_TO_MAINTAIN:
+        catalog.load_table(("my_namespace", table)).append(data)
+
+        check_table_pyiceberg(catalog, table, len(PRE_MIGRATION_ROWS) + len(POST_MIGRATION_ROWS))
+
+    # new table
+    data = to_arrow(NEW_TABLE_ROWS)
+    catalog.create_table(("my_namespace", TABLE_POST_MIGRATION), schema=arrow_schema()).append(data)
+    check_table_pyiceberg(catalog, TABLE_POST_MIGRATION, len(NEW_TABLE_ROWS))
+
+# Per engine: how to connect to the catalog and the implementations of the tasks.
+ENGINES = {
+    "pyiceberg": (pyiceberg_catalog, {
+        "read": read_pyiceberg,
+        "write_pre_migration": write_pre_migration_pyiceberg,
+        "write_post_migration": write_post_migration_pyiceberg,
+    }),
+    "spark": (spark_session, {
+        "read": read,
+        "write_pre_migration": write_pre_migration,
+        "write_post_migration": write_post_migration,
+    }),
+}
+TASKS = ["read", "write_pre_migration", "write_post_migration"]
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "task",
-        choices = ["read", "write_pre_migration", "write_post_migration"]
+        "tasks",
+        nargs = "+",
+        choices = TASKS,
+        metavar = "task",
     )
     parser.add_argument("catalog_url")
+    parser.add_argument(
+        "--engine",
+        choices = list(ENGINES),
+        default = "pyiceberg",
+        help = "Client used to talk to lakekeeper. Spark is much slower to start up. (default: %(default)s)",
+    )
     args = parser.parse_args()
 
-    spark = spark_session(args.catalog_url)
-    if args.task == "read":
-        read(spark)
-    elif args.task == "write_pre_migration":
-        write_pre_migration(spark)
-    elif args.task == "write_post_migration":
-        write_post_migration(spark)
+    # Creating the session (especially for spark) is expensive, so create it once and reuse it for
+    # all tasks.
+    connect, tasks = ENGINES[args.engine]
+    session = connect(args.catalog_url)
+    for task in args.tasks:
+        tasks[task](session)
     return 0
 
 if __name__ == "__main__":